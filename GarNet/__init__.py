@@ -1,4 +1,4 @@
 #!/usr/bin/env python3
 
-from .garnet import construct_garnet_file, map_peaks, TF_regression
+from .garnet import construct_garnet_file, map_peaks, TF_regression, clear_garnet_cache
 
@@ -33,19 +33,27 @@ parser.add_argument('-g', '--garnet', dest='garnet_file', type=str, required=Fal
 parser.add_argument('-e', '--expression', dest='expression_file', type=str, required=False,
 	help='a two-column tab-delimited file of genes and (relative) expression levels')
 parser.add_argument('-i', '--intermediate', dest='intermediate_file', type=str, required=False,
-	help='a .garnet.tsv file output by this program with mapped peaks')
+	help='a .garnet.tsv (or .garnet.parquet / .garnet.feather) file output by this program with mapped peaks')
 
 parser.add_argument('-o', '--output', dest='output_dir', action=FullPaths, type=directory, required=True,
 	help='output directory path')
+parser.add_argument('-f', '--format', dest='output_format', choices=['tsv', 'parquet', 'feather'], default='tsv',
+	help='file format of output tables. parquet and feather are much faster to write and read than tsv for large outputs')
 
 
-def output(dataframe, output_dir, filename):
+def output(dataframe, output_dir, filename, output_format='tsv'):
 	"""
 	Arguments:
-		dataframe (dataframe): the result of the analysis we want to write out as a csv.
+		dataframe (dataframe): the result of the analysis we want to write out.
 		output_dir (str): the fullpath of a directory we will write our output to.
+		filename (str): the name of the output file, without extension.
+		output_format (str): one of 'tsv', 'parquet', or 'feather', which also determines the file extension.
 	"""
-	dataframe.to_csv(os.path.join(output_dir, filename), sep='\t', header=True, index=False)
+	filepath = os.path.join(output_dir, filename + '.' + output_format)
+
+	if output_format == 'parquet': dataframe.to_parquet(filepath, engine='pyarrow', compression='zstd', index=False)
+	elif output_format == 'feather': dataframe.reset_index(drop=True).to_feather(filepath)
+	else: dataframe.to_csv(filepath, sep='\t', header=True, index=False)
 
 
 def main():
@@ -55,15 +63,15 @@ def main():
 	# "Map Peaks"
 	if args.peaks_file and args.garnet_file:
 		result_dataframe = map_peaks(args.peaks_file, args.garnet_file)
-		output(result_dataframe, args.output_dir, args.peaks_file+'.garnet.tsv')
+		output(result_dataframe, args.output_dir, args.peaks_file+'.garnet', args.output_format)
 
 		# "Map Peaks + TF Regression"
 		if args.expression_file:
-			output(TF_regression(result_dataframe, args.expression_file), args.output_dir, args.expression_file+'.prizes.tsv')
+			output(TF_regression(result_dataframe, args.expression_file), args.output_dir, args.expression_file+'.prizes', args.output_format)
 
 	# "TF Regression"
 	elif args.expression_file and args.intermediate_file:
-		output(TF_regression(args.intermediate_file, args.expression_file), args.output_dir, args.expression_file+'.prizes.tsv')
+		output(TF_regression(args.intermediate_file, args.expression_file), args.output_dir, args.expression_file+'.prizes', args.output_format)
 
 	else: raise Exception('Improper parameters. See GarNet --help for more.')
 
@@ -8,6 +8,9 @@ import os
 import pickle
 import logging
 import subprocess
+import gzip
+import itertools
+from functools import lru_cache
 
 # Core python external libraries
 import numpy as np
@@ -15,18 +18,19 @@ import pandas as pd
 import matplotlib
 matplotlib.use('Agg') # This is a workaround if encountering tkinter import error
 import matplotlib.pyplot as plt
-from statsmodels.formula.api import ols as linear_regression
-from statsmodels.graphics.regressionplots import abline_plot as plot_regression
+from scipy.stats import t as t_distribution
 
 # Peripheral python external libraries
 from pybedtools import BedTool
 import jinja2
+from joblib import Parallel, delayed
 
-# list of public methods:
-__all__ = [ "construct_garnet_file", "map_peaks", "TF_regression" ]
+# Optional python external libraries
+try: from numba import njit, prange
+except ImportError: njit, prange = None, range
 
-templateLoader = jinja2.FileSystemLoader(os.path.dirname(os.path.abspath(__file__)))
-templateEnv = jinja2.Environment(loader=templateLoader)
+# list of public methods:
+__all__ = [ "construct_garnet_file", "map_peaks", "TF_regression", "clear_garnet_cache" ]
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -36,6 +40,15 @@ handler.setFormatter(logging.Formatter('%(asctime)s - GarNet: %(levelname)s - %(
 logger.addHandler(handler)
 
 
+@lru_cache(maxsize=1)
+def _template_environment():
+	"""
+	The jinja environment for the html summary, created on first use since most calls never render one.
+	"""
+	templateLoader = jinja2.FileSystemLoader(os.path.dirname(os.path.abspath(__file__)))
+	return jinja2.Environment(loader=templateLoader, autoescape=jinja2.select_autoescape(['html', 'jinja']))
+
+
 ######################################## File Parsing Logic #######################################
 
 def parse_expression_file(expression_file):
@@ -58,11 +71,18 @@ def parse_expression_file(expression_file):
 
 def _parse_motifs_and_genes_file_or_dataframe(motifs_and_genes_file_or_dataframe):
 	"""
-	If the argument is a dataframe, return it. Otherwise if the argument is a string, try to read a dataframe from it, and return that
+	If the argument is a dataframe, return it. Otherwise if the argument is a string, try to read a dataframe from it
+	(as parquet or feather if the extension says so, otherwise as tsv), and return that
 	"""
 
-	if isinstance(motifs_and_genes_file_or_dataframe, str):
-		motifs_and_genes_dataframe = pd.read_csv(motifs_and_genes_file_or_dataframe, delimiter='\t', header=0, index_col=False)
+	if isinstance(motifs_and_genes_file_or_dataframe, str) and motifs_and_genes_file_or_dataframe.endswith('.parquet'):
+		motifs_and_genes_dataframe = pd.read_parquet(motifs_and_genes_file_or_dataframe, engine='pyarrow')
+
+	elif isinstance(motifs_and_genes_file_or_dataframe, str) and motifs_and_genes_file_or_dataframe.endswith('.feather'):
+		motifs_and_genes_dataframe = pd.read_feather(motifs_and_genes_file_or_dataframe)
+
+	elif isinstance(motifs_and_genes_file_or_dataframe, str):
+		motifs_and_genes_dataframe = pd.read_csv(motifs_and_genes_file_or_dataframe, delimiter='\t', header=0, index_col=False, dtype={"chrom": "category", "motifName": "category", "geneName": "category"})
 
 	elif isinstance(motifs_and_genes_file_or_dataframe, pd.DataFrame):
 		motifs_and_genes_dataframe = motifs_and_genes_file_or_dataframe
@@ -72,17 +92,247 @@ def _parse_motifs_and_genes_file_or_dataframe(motifs_and_genes_file_or_dataframe
 	return motifs_and_genes_dataframe
 
 
+def parse_peaks_file(peaks_file):
+	"""
+	Parse the genomic coordinates of a BED file of peaks into a dataframe with pyarrow's multithreaded csv reader.
+	Only the first three columns (chrom, start, end) are kept, since those are all we need for intersection.
+	Leading `track`, `browser` and `#` header lines are skipped, as bedtools does.
+
+	Arguments:
+		peaks_file (str or path-like): path to a BED file of peaks, optionally gzipped
+
+	Returns:
+		pd.dataframe: peaks dataframe with chrom, start, end columns
+	"""
+	# pyarrow can't select columns by position (and BED files vary in their number of columns), so we read them all and keep the first three.
+	peaks = pd.read_csv(peaks_file, delimiter='\t', header=None, skiprows=_count_bed_header_lines(peaks_file), engine='pyarrow').iloc[:, :3]
+	peaks.columns = ["chrom", "start", "end"]
+
+	return peaks.astype({"chrom": str, "start": np.int32, "end": np.int32}).astype({"chrom": "category"})
+
+
+def _count_bed_header_lines(bed_file):
+	"""
+	Count the `track`, `browser`, `#` (and blank) lines at the top of a BED file, which pyarrow can't skip by itself.
+	"""
+	with (gzip.open if os.fspath(bed_file).endswith('.gz') else open)(bed_file, 'rt') as bed:
+		return sum(1 for line in itertools.takewhile(lambda line: line.startswith(('track', 'browser', '#')) or not line.strip(), bed))
+
+
+def parse_garnet_file(garnet_file):
+	"""
+	Parse a garnet file (as written by construct_garnet_file) of motifs and their nearby genes into a dataframe.
+	Garnet files can run to several GB, so the file is memory-mapped and parsed in place rather than read into a buffer first.
+
+	Arguments:
+		garnet_file (string or FILE): tab-delimited garnet file, without header, optionally compressed (e.g. .zst or .gz)
+
+	Returns:
+		pd.dataframe: motifs and genes dataframe, with chromosome, motif and gene names as categoricals
+	"""
+	return pd.read_csv(garnet_file, delimiter='\t', header=None, names=["chrom", "start", "end", "motifName", "motifScore", "motifStrand", "geneName", "geneStart", "geneEnd", "motif_gene_distance"], dtype={"chrom": "category", "motifName": "category", "geneName": "category"}, memory_map=True)
+
+
+def group_by_chromosome(dataframe):
+	"""
+	Arguments:
+		dataframe (pd.dataframe): a dataframe with a chrom column
+
+	Returns:
+		dict: chromosome name to the positions of the rows of dataframe on that chromosome
+	"""
+	return dataframe.groupby('chrom', sort=False, observed=True).indices
+
+
+def coordinates_by_chromosome(dataframe):
+	"""
+	Split the interval coordinates of a dataframe by chromosome into contiguous arrays, which is all the
+	intersection needs, rather than keeping a dataframe (or a python object per interval) for each chromosome.
+	Each chromosome's intervals are sorted by start once here, so the intersection never has to re-sort them.
+
+	Arguments:
+		dataframe (pd.dataframe): a dataframe with chrom, start, end columns
+
+	Returns:
+		dict: chromosome name to a dict of int32 'starts' and 'ends' arrays sorted by start, and the 'rows' (positions) of dataframe they came from
+	"""
+	starts = dataframe['start'].values.astype(np.int32)
+	ends = dataframe['end'].values.astype(np.int32)
+
+	sorted_rows_by_chrom = {chrom: rows[np.argsort(starts[rows], kind='mergesort')] for chrom, rows in group_by_chromosome(dataframe).items()}
+
+	return {chrom: {'starts': starts[rows], 'ends': ends[rows], 'rows': rows} for chrom, rows in sorted_rows_by_chrom.items()}
+
+
+@lru_cache(maxsize=1)
+def _load_garnet_file(garnet_filepath, modified_time):
+	"""
+	Parse a garnet file and split its coordinates by chromosome, remembering the result for the most recent garnet file,
+	since successive calls to map_peaks are usually made against the same (large) garnet file. The file's modification
+	time is part of the cache key so that a rewritten garnet file is parsed afresh.
+
+	Returns:
+		(pd.dataframe, dict): the garnet dataframe, and its coordinates by chromosome
+	"""
+	motifs = parse_garnet_file(garnet_filepath)
+	return motifs, coordinates_by_chromosome(motifs)
+
+
+###################################### Interval Intersection #######################################
+
+def motifs_within_peaks(motif_starts, motif_ends, peak_starts, peak_ends):
+	"""
+	Find all (motif, peak) pairs on a single chromosome for which the motif lies entirely within the peak,
+	i.e. peak_start <= motif_start and motif_end <= peak_end. This matches `bedtools intersect -wa -f 1`.
+
+	Rather than searching a tree once per motif, we binary search all motifs at once in the peaks, which must
+	be sorted by start. Any peak containing a motif must start at or before the motif start, and at or after
+	motif_end - max_peak_length, so the candidates for each motif are a contiguous slice of the sorted peaks,
+	which we materialize and filter on peak end. So that a few very long peaks don't widen that slice for every
+	motif, peaks are split into classes of similar length (within a factor of two), each searched separately.
+	Then within a class, most candidates in a motif's slice do contain it, and memory stays proportional to the matches.
+
+	Arguments:
+		motif_starts (np.array): start coordinates of motifs
+		motif_ends (np.array): end coordinates of motifs
+		peak_starts (np.array): start coordinates of peaks, sorted
+		peak_ends (np.array): end coordinates of peaks, in the same order as peak_starts
+
+	Returns:
+		(np.array, np.array): positional indices of motifs, and of the peaks which contain them, ordered by motif then peak
+	"""
+	motif_idx, peak_idx = [np.array([], dtype=np.intp)], [np.array([], dtype=np.intp)]
+
+	length_classes = np.log2(np.maximum(peak_ends - peak_starts, 1)).astype(int)
+
+	for length_class in np.unique(length_classes):
+		in_class = np.flatnonzero(length_classes == length_class)
+		motif_idx_in_class, peak_pos_in_class = _motifs_within_similar_length_peaks(motif_starts, motif_ends, peak_starts[in_class], peak_ends[in_class])
+		motif_idx.append(motif_idx_in_class)
+		peak_idx.append(in_class[peak_pos_in_class])
+
+	motif_idx, peak_idx = np.concatenate(motif_idx), np.concatenate(peak_idx)
+	order = np.lexsort((peak_idx, motif_idx))
+
+	return motif_idx[order], peak_idx[order]
+
+
+def _motifs_within_similar_length_peaks(motif_starts, motif_ends, peak_starts, peak_ends):
+	"""
+	The sweep of motifs_within_peaks, over one class of (sorted) peaks. Returns positional indices of motifs, and of the peaks which contain them.
+	"""
+	if len(motif_starts) == 0 or len(peak_starts) == 0: return np.array([], dtype=np.intp), np.array([], dtype=np.intp)
+
+	max_peak_length = (peak_ends - peak_starts).max()
+
+	lo = np.searchsorted(peak_starts, motif_ends - max_peak_length, side='left')
+	hi = np.searchsorted(peak_starts, motif_starts, side='right')
+	counts = np.maximum(hi - lo, 0)
+
+	# flatten the candidate slices [lo, hi) of every motif into parallel arrays of (motif, peak) positions
+	motif_idx = np.repeat(np.arange(len(motif_starts)), counts)
+	offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+	peak_pos = np.repeat(lo, counts) + offsets
+
+	contained = peak_ends[peak_pos] >= motif_ends[motif_idx]
+
+	return motif_idx[contained], peak_pos[contained]
+
+
+########################################## Regression Logic ########################################
+
+def linear_regression_by_group(dataframe, group_column, x_column, y_column):
+	"""
+	Ordinary least squares regression of y on x within every group of a dataframe at once.
+
+	Rather than fitting one model per group, we sort rows by group and compute each group's sums (Σx, Σy, Σxx, Σxy, Σyy)
+	in a single pass, and derive slope, intercept and the two-sided p-value of the slope in closed form.
+
+	Arguments:
+		dataframe (pd.dataframe): a dataframe with group, x, and y columns
+		group_column (str): column to group by
+		x_column (str): column of the independent variable
+		y_column (str): column of the dependent variable
+
+	Returns:
+		pd.dataframe: n, slope, intercept, and pval for each group, indexed by group
+	"""
+	codes, groups = pd.factorize(dataframe[group_column], sort=True)
+	x = dataframe[x_column].to_numpy()
+	y = dataframe[y_column].to_numpy()
+
+	# lay rows out contiguously by group, so that group g occupies rows offsets[g] to offsets[g+1]
+	order = np.argsort(codes, kind='mergesort')
+	offsets = np.searchsorted(codes[order], np.arange(len(groups)+1))
+	x, y = x[order], y[order]
+
+	if njit:
+		n, Sx, Sy, Sxx, Sxy, Syy = _grouped_sums(x, y, offsets)
+
+	else:
+		# every group is non-empty, so reduceat sums exactly the rows of each group. Products and sums are taken in float64.
+		starts = offsets[:-1]
+		n = np.diff(offsets).astype(float)
+		x, y = x.astype(np.float64), y.astype(np.float64)
+		Sx, Sy = np.add.reduceat(x, starts), np.add.reduceat(y, starts)
+		Sxx, Sxy, Syy = (np.add.reduceat(product, starts) for product in [x*x, x*y, y*y])
+
+	with np.errstate(divide='ignore', invalid='ignore'):
+		# centered sums of squares and cross-products
+		SSxx = Sxx - Sx*Sx/n
+		SSxy = Sxy - Sx*Sy/n
+		SSyy = Syy - Sy*Sy/n
+
+		slope = SSxy / SSxx
+		intercept = (Sy - slope*Sx) / n
+		residual_sum_of_squares = np.maximum(SSyy - slope*SSxy, 0)
+		standard_error = np.sqrt(residual_sum_of_squares / (n - 2) / SSxx)
+		pval = 2 * t_distribution.sf(np.abs(slope / standard_error), n - 2)
+
+	return pd.DataFrame({'n': n, 'slope': slope, 'intercept': intercept, 'pval': pval}, index=groups)
+
+
+def _grouped_sums(x, y, offsets):
+	"""
+	Sums needed for linear regression within each group of rows, where group g occupies rows offsets[g] to offsets[g+1].
+	Compiled with numba when available, in which case groups are summed in parallel. Products and sums are taken in float64.
+
+	Returns:
+		np.array: 6 x n_groups array of n, Σx, Σy, Σxx, Σxy, Σyy
+	"""
+	n_groups = len(offsets) - 1
+	sums = np.zeros((6, n_groups))
+
+	for g in prange(n_groups):
+		for i in range(offsets[g], offsets[g+1]):
+			sums[0, g] += 1
+			xi, yi = np.float64(x[i]), np.float64(y[i])
+			sums[1, g] += xi
+			sums[2, g] += yi
+			sums[3, g] += xi * xi
+			sums[4, g] += xi * yi
+			sums[5, g] += yi * yi
+
+	return sums
+
+if njit: _grouped_sums = njit(parallel=True, cache=True)(_grouped_sums)
+
+
 ######################################### Public Functions #########################################
 
-def map_peaks(peaks_filepath_or_list_of_peaks_filepaths, garnet_filepath):
+def map_peaks(peaks_filepath_or_list_of_peaks_filepaths, garnet_filepath, n_jobs=-1, cache_garnet_file=True):
 	"""
 	Find motifs and associated genes local to peaks.
 
 	This function intersects peaks from an epigenomics dataset with TF motifs.
 
 	Arguments:
-		peaks_filepath_or_list_of_peaks_filepaths (str or list): filepath of the peaks file, or list of such paths
+		peaks_filepath_or_list_of_peaks_filepaths (str or list): filepath of the peaks file (BED, optionally gzipped), or list of such paths
 		garnet_filepath (str): filepath to the garnet file.
+		n_jobs (int): number of processes across which to split chromosomes (-1 uses all cores)
+		cache_garnet_file (bool): keep the parsed garnet file in memory, so that later calls against the same garnet
+			file don't parse it again. This holds on to memory on the order of the garnet file's size until a different
+			garnet file is mapped against, or clear_garnet_cache() is called. Pass False to parse it afresh and not keep it.
 
 	Returns:
 		pd.DataFrame: a dataframe with rows of transcription factor binding motifs and nearby genes with
@@ -95,23 +345,37 @@ def map_peaks(peaks_filepath_or_list_of_peaks_filepaths, garnet_filepath):
 	else: list_of_peaks_filepaths = [peaks_filepath_or_list_of_peaks_filepaths]
 	assert all([os.path.isfile(peaks_filepath) for peaks_filepath in list_of_peaks_filepaths])
 
-	output = []
+	if cache_garnet_file: motifs, motifs_by_chrom = _load_garnet_file(garnet_filepath, os.path.getmtime(garnet_filepath))
+	else: motifs, motifs_by_chrom = _load_garnet_file.__wrapped__(garnet_filepath, os.path.getmtime(garnet_filepath))
 
-	for peaks_filepath in list_of_peaks_filepaths:
+	peaks_by_chrom_by_file = [coordinates_by_chromosome(parse_peaks_file(peaks_filepath)) for peaks_filepath in list_of_peaks_filepaths]
 
-		peaks = BedTool(peaks_filepath)
-		motifs = BedTool(garnet_filepath)
+	# Report each motif once for every peak it lies entirely within, like `bedtools intersect -wa -f 1`
+	# Peaks files and chromosomes are independent, so we fan out over every (peaks file, chromosome) pair at once,
+	# and each worker is shipped only the coordinate arrays for one chromosome.
+	jobs = [(i, chrom) for i, peaks_by_chrom in enumerate(peaks_by_chrom_by_file) for chrom in sorted(motifs_by_chrom.keys() & peaks_by_chrom.keys())]
+	matches = Parallel(n_jobs=n_jobs, backend='loky')(
+		delayed(motifs_within_peaks)(motifs_by_chrom[chrom]['starts'], motifs_by_chrom[chrom]['ends'],
+		                             peaks_by_chrom_by_file[i][chrom]['starts'], peaks_by_chrom_by_file[i][chrom]['ends']) for i, chrom in jobs)
 
-		intersected = motifs.intersect(peaks, wa=True, f=1)
-		intersected_df = intersected.to_dataframe(names=["chrom", "start", "end", "motifName", "motifScore", "motifStrand", "geneName", "geneStart", "geneEnd", "motif_gene_distance"])
+	motif_rows_by_file = [[np.array([], dtype=np.intp)] for peaks_filepath in list_of_peaks_filepaths]
+	for (i, chrom), (motif_idx, _) in zip(jobs, matches): motif_rows_by_file[i].append(motifs_by_chrom[chrom]['rows'][motif_idx])
 
-		output.append(intersected_df)
+	# Gather each file's matched motif rows in one take, in the order they appear in the garnet file
+	output = [motifs.take(np.sort(np.concatenate(motif_rows), kind='mergesort')).reset_index(drop=True) for motif_rows in motif_rows_by_file]
 
 	# If this function was passed a single file, return a single dataframe
 	if len(output) == 1: output = output[0]
 	return output
 
 
+def clear_garnet_cache():
+	"""
+	Free the parsed garnet file which map_peaks keeps in memory between calls.
+	"""
+	_load_garnet_file.cache_clear()
+
+
 def TF_regression(motifs_and_genes_file_or_dataframe, expression_file, output_dir=None):
 	"""
 	Do linear regression of the expression of genes versus the strength of the assiciated transcription factor binding motifs and report results.
@@ -134,7 +398,9 @@ def TF_regression(motifs_and_genes_file_or_dataframe, expression_file, output_di
 	motifs_and_genes_dataframe = _parse_motifs_and_genes_file_or_dataframe(motifs_and_genes_file_or_dataframe)
 	expression_dataframe = parse_expression_file(expression_file)
 
-	motifs_genes_and_expression_levels = motifs_and_genes_dataframe.merge(expression_dataframe, left_on='geneName', right_on='name', how='inner')
+	# Look up each gene's expression level (rather than merging), keeping only genes we have expression for
+	expression_levels = expression_dataframe.drop_duplicates('name').set_index('name')['expression']
+	motifs_genes_and_expression_levels = motifs_and_genes_dataframe.assign(expression=motifs_and_genes_dataframe['geneName'].map(expression_levels).astype(float)).dropna(subset=['expression'])
 
 	# the same geneName might have different names but since the expression is geneName-wise
 	# keep the closest motif to gene in the case of duplicates
@@ -142,50 +408,69 @@ def TF_regression(motifs_and_genes_file_or_dataframe, expression_file, output_di
 	if 'geneName' in motifs_genes_and_expression_levels.columns:
 		motifs_genes_and_expression_levels["abs_distance"] = motifs_genes_and_expression_levels.motif_gene_distance.abs()
 		motifs_genes_and_expression_levels = motifs_genes_and_expression_levels.sort_values("motifScore", ascending=True) \
-		                                                                       .drop("abs_distance", axis=1) \
-		                                                                       .drop_duplicates(subset=['geneName', 'motifName'], keep="first")
+		                                                                       .drop("abs_distance", axis=1)
+
+		# Drop duplicate (geneName, motifName) pairs, keeping the first, by combining both columns' integer codes
+		# into a single int64 key, which is much cheaper to deduplicate than pairs of strings.
+		gene_codes, _ = pd.factorize(motifs_genes_and_expression_levels['geneName'])
+		motif_codes, motifs = pd.factorize(motifs_genes_and_expression_levels['motifName'])
+		pair_codes = (gene_codes.astype(np.int64) + 1) * (len(motifs) + 1) + (motif_codes + 1)
+		_, first_of_each_pair = np.unique(pair_codes, return_index=True)
+		motifs_genes_and_expression_levels = motifs_genes_and_expression_levels.iloc[np.sort(first_of_each_pair)]
 
-	motifs_genes_and_expression_levels['motifScore'] = motifs_genes_and_expression_levels['motifScore'].astype(float)
+	# single precision is plenty for motif scores and expression levels, and halves the memory the regression sums scan
+	motifs_genes_and_expression_levels['motifScore'] = motifs_genes_and_expression_levels['motifScore'].astype(np.float32)
+	motifs_genes_and_expression_levels['expression'] = motifs_genes_and_expression_levels['expression'].astype(np.float32)
 
-	TFs_and_associated_expression_profiles = list(motifs_genes_and_expression_levels.groupby('motifName'))
+	# Occasionally there's only one gene associated with a TF, which we can't fit a line to.
+	motifs_genes_and_expression_levels = motifs_genes_and_expression_levels[motifs_genes_and_expression_levels.groupby('motifName', observed=True)['motifName'].transform('size') >= 5]
+
+	TFs_and_associated_expression_profiles = list(motifs_genes_and_expression_levels.groupby('motifName', observed=True))
 	imputed_TF_features = []
 
 	logger.info("Performing linear regression for "+str(len(TFs_and_associated_expression_profiles))+" transcription factor expression profiles...")
 
-	for TF_name, expression_profile in TFs_and_associated_expression_profiles:
+	if output_dir:
+		regression_plots_dir = os.path.join(output_dir, "regression_plots", "")
+		os.makedirs(regression_plots_dir, exist_ok=True)
 
-		# Occasionally there's only one gene associated with a TF, which we can't fit a line to.
-		if len(expression_profile) < 5: continue
+	# Ordinary Least Squares linear regression, for all TFs at once
+	regressions = linear_regression_by_group(motifs_genes_and_expression_levels, 'motifName', 'motifScore', 'expression')
+
+	for TF_name, expression_profile in TFs_and_associated_expression_profiles:
 
 		# This allows heavier points to be visualized on the top instead of being hidden by long distance points
 		expression_profile = expression_profile.reindex(expression_profile.motif_gene_distance.abs().sort_values(inplace=False, ascending=False).index)
 
-		# Ordinary Least Squares linear regression
-		result = linear_regression(formula="expression ~ motifScore", data=expression_profile).fit()
+		slope, intercept, pval = regressions.loc[TF_name, ['slope', 'intercept', 'pval']]
 
 		if output_dir:
-			plot = plot_regression(model_results=result, ax=expression_profile.plot(x="motifScore", y="expression", kind="scatter", grid=True))
+			ax = expression_profile.plot(x="motifScore", y="expression", kind="scatter", grid=True)
+
+			# Draw the fitted line across the plot
+			x = np.array(ax.get_xlim())
+			ax.plot(x, intercept + slope*x)
+			ax.set_xlim(x)
 
 			# Add color to points based on distance to gene
 			plt.scatter(expression_profile["motifScore"], expression_profile["expression"],
 				c=[abs(v) for v in expression_profile["motif_gene_distance"].tolist()],
 				norm=matplotlib.colors.LogNorm(vmin=1, vmax=100000, clip=True),
 				cmap=matplotlib.cm.Blues_r)
-			plt.title("%s, %0.4f" %(TF_name, result.pvalues['motifScore']))
+			plt.title("%s, %0.4f" %(TF_name, pval))
 			plt.colorbar()
 
-			os.makedirs(os.path.join(output_dir, "regression_plots"), exist_ok=True)
-			plot.savefig(os.path.join(output_dir, "regression_plots", TF_name.replace("/", "-") + '.png'))
+			ax.figure.savefig(os.path.join(regression_plots_dir, TF_name.replace("/", "-") + '.png'))
 			plt.close()
 
 		# TODO: implement FDR calculation
-		imputed_TF_features.append((TF_name, result.params['motifScore'], result.pvalues['motifScore'], ','.join(expression_profile['geneName'].tolist())))
+		imputed_TF_features.append((TF_name, slope, pval, ','.join(expression_profile['geneName'].tolist())))
 
 	imputed_TF_features_dataframe = pd.DataFrame(imputed_TF_features, columns=["Transcription Factor", "Slope", "P-Value", "Targets"]).sort_values("P-Value")
 
 	# If we're supplied with an output_dir, we'll put a summary html file in there as well.
 	if output_dir:
-		html_output = templateEnv.get_template("summary.jinja").render(images_dir=os.path.join(output_dir,"regression_plots",""), TFs=sorted(imputed_TF_features, key=lambda x: x[2]))
+		html_output = _template_environment().get_template("summary.jinja").render(images_dir=regression_plots_dir, TFs=sorted(imputed_TF_features, key=lambda x: x[2]))
 		with open(os.path.join(output_dir,"summary.html"), "w") as summary_output_file:
 			summary_output_file.write(html_output)
 
@@ -246,7 +531,7 @@ def construct_garnet_file(reference_file, motif_file_or_files, output_file, wind
 	Arguments:
 		reference_file (str): path to the reference gene BED file
 		motifs_file (str): path to the motifs BED file
-		output_file (str): ouput GarNet file path
+		output_file (str): ouput GarNet file path. Paths ending in .zst or .gz are written compressed.
 		window_size (int): the size of the window
 
 	Returns:
@@ -278,15 +563,17 @@ def construct_garnet_file(reference_file, motif_file_or_files, output_file, wind
 	# that is closest to the gene (this depends on which strand the motif is on), and next
 	# finding the distance between the closest end to the gene TSS. A negative value indicates
 	# that the motif is upstream of the TSS.
-	motif_genes_df["motifClosestEnd"] = motif_genes_df.apply(lambda row: row["motifEnd"] if row["motifStrand"] == "+" else row["motifStart"], axis=1)
+	motif_genes_df["motifClosestEnd"] = np.where(motif_genes_df["motifStrand"] == "+", motif_genes_df["motifEnd"], motif_genes_df["motifStart"])
 	motif_genes_df["motif_gene_distance"] = (motif_genes_df["motifClosestEnd"] - motif_genes_df["tssStart"]) * \
-	                                         motif_genes_df.apply(lambda row: 1 if row["tssStrand"] == "+" else -1, axis=1)
+	                                         np.where(motif_genes_df["tssStrand"] == "+", 1, -1)
 
 	# Filter and reorder columns
 	motif_genes_df = motif_genes_df[["motifChrom", "motifStart", "motifEnd", "motifName", "motifScore", "motifStrand",
 	                                 "geneName", "tssStart", "tssEnd", "motif_gene_distance"]]
 
-	motif_genes_df.to_csv(output_file, sep='\t', index=False, header=False)
+	# Garnet files are large, so compress them if asked to by the file extension. zstandard (.zst) is fast enough to use multithreaded.
+	compression = {'method': 'zstd', 'level': 3, 'threads': -1} if output_file.endswith('.zst') else 'infer'
+	motif_genes_df.to_csv(output_file, sep='\t', index=False, header=False, compression=compression)
 	logger.info('  - %d motif-gene associations found and written to %s' %(motif_genes_df.shape[0], output_file))
 
 	return motif_genes_df
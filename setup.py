@@ -7,19 +7,27 @@ setup(
     version='0.5.0',
     url='https://github.com/fraenkel-lab/GarNet',
     classifiers=[
-        'Programming Language :: Python :: 3.5',
-        'Programming Language :: Python :: 3.6'],
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10'],
+    python_requires='>=3.8',
     license='MIT',
     author='zfrenchee, iamjli',
     author_email='alex@lenail.org, iamjli@mit.edu',
     description='',
     install_requires=[
         'numpy',
-        'pandas',
-        'statsmodels',
+        'scipy',
+        'pandas>=1.4',
+        'pyarrow',
         'matplotlib',
         'jinja2',
-        'pybedtools'
+        'pybedtools',
+        'joblib'
     ],
+    extras_require={
+        'numba': ['numba'],
+        'zstd': ['zstandard']
+    },
 )
 